@@ -1,110 +1,177 @@
 import streamlit as st
 import os
+import shutil
 import tempfile
 import subprocess
 import time
-from moviepy.editor import VideoFileClip, CompositeVideoClip, concatenate_videoclips
-from PIL import Image
-import numpy as np
-import cv2
-import shutil
-import random
-from io import BytesIO  # ✅ Add this import at the top of your file
+
+from instrumentation import JobMetrics, get_files_size, log_metrics
+from jobs import DONE, FAILED, PRIORITY_INTERACTIVE, PRIORITY_RENDER, QUEUED, get_scheduler
+from output_store import cleanup_outputs, get_output_path, get_output_url, new_session_id, save_output
+from result_cache import get_cached, hash_upload, make_cache_key, store_result
+from video_processing import (
+    WATERMARK_TEXT,
+    InputError,
+    render_contact_sheet,
+    render_sequential,
+    render_side_by_side,
+    render_style_outputs,
+    render_thumbnail,
+    validate_inputs,
+)
 
 st.set_page_config(page_title="🎨 AI Video Effects App", layout="centered")
 st.title("🎨 AI Video Effects App")
 
-# ---------- Style Filter Functions ----------
-def get_transform_function(style_name):
-    if style_name == "🌸 Soft Pastel Anime-Like Style":
-        def pastel_style(frame):
-            # Boost colors more
-            r = np.clip(frame[:, :, 0] * 1.12 + 30, 0, 255)
-            g = np.clip(frame[:, :, 1] * 1.10 + 25, 0, 255)
-            b = np.clip(frame[:, :, 2] * 1.18 + 35, 0, 255)
-            enhanced = np.stack([r, g, b], axis=2).astype(np.uint8)
-
-            # Apply soft smoothing using bilateral filter for anime look
-            blurred = cv2.bilateralFilter(enhanced, 9, 75, 75).astype(np.float32)
-
-            # Light pink/blue tint
-            tint = np.array([10, -5, 15], dtype=np.float32)
-            result = np.clip(blurred + tint, 0, 255).astype(np.uint8)
-            return result
-        return pastel_style
-
-    elif style_name == "🎮 Cinematic Warm Filter":
-        def warm_style(frame):
-            # Warmer highlights and stronger contrast
-            r = np.clip(frame[:, :, 0] * 1.25 + 25, 0, 255)
-            g = np.clip(frame[:, :, 1] * 1.10 + 15, 0, 255)
-            b = np.clip(frame[:, :, 2] * 0.90 - 5, 0, 255)
-            stacked = np.stack([r, g, b], axis=2).astype(np.float32)
-
-            # Dramatic vignette effect
-            rows, cols = r.shape
-            Y, X = np.ogrid[:rows, :cols]
-            center = (rows / 2, cols / 2)
-            vignette = 1 - ((X - center[1]) ** 2 + (Y - center[0]) ** 2) / (1.1 * center[0] * center[1])
-            vignette = np.clip(vignette, 0.2, 1)[..., np.newaxis]
-
-            # Subtle film grain
-            grain = np.random.normal(0, 4, frame.shape).astype(np.float32)
-            result = np.clip(stacked * vignette + grain, 0, 255).astype(np.uint8)
-            return result
-        return warm_style
-
-    return lambda frame: frame
-
-# ---------- Rain Overlay ----------
-def add_rain_effect(frame, density=0.002):
-    frame = frame.copy()
-    h, w, _ = frame.shape
-    num_drops = int(h * w * density)
-    for _ in range(num_drops):
-        x = random.randint(0, w - 1)
-        y = random.randint(0, h - 20)
-        length = random.randint(10, 20)
-        thickness = 1
-        color = (200, 200, 255)
-        cv2.line(frame, (x, y), (x, y + length), color, thickness)
-    return frame
-
-def get_rain_function(option):
-    if option == "🌧️ Light Rain (Default)":
-        return lambda f: add_rain_effect(f, density=0.002)
-    elif option == "🌦️ Extra Light Rain":
-        return lambda f: add_rain_effect(f, density=0.0008)
-    elif option == "🌤️ Ultra Light Rain":
-        return lambda f: add_rain_effect(f, density=0.0004)
+
+# Outputs stay on disk in a per-session store; session_state only keeps names
+session_id = st.session_state.setdefault("output_session_id", new_session_id())
+cleanup_outputs(keep=session_id)
+static_serving = st.get_option("server.enableStaticServing")
+
+
+# Without a static URL (static serving off, or a file over the route's 200 MB
+# limit) there is no inline player: st.video on the path would load the whole
+# file into Streamlit's in-memory media storage on every rerun
+def show_output_video(name):
+    url = get_output_url(session_id, name) if static_serving else None
+    if url:
+        st.video(url)
+    elif static_serving:
+        st.info("🎞️ This video is too large to preview here. Use the download button below.")
     else:
-        return lambda f: f
-
-# ---------- Watermark ----------
-def apply_watermark(input_path, output_path, text="@USMIKASHMIRI"):
-    watermark_filter = (
-        "scale=ceil(iw/2)*2:ceil(ih/2)*2," +
-        f"drawtext=fontfile='/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf':" +
-        f"text='{text}':x=w-mod(t*240\\,w+tw):y=h-160:"
-        "fontsize=40:fontcolor=white@0.6:shadowcolor=black:shadowx=2:shadowy=2"
-    )
-    cmd = [
-        "ffmpeg", "-y", "-i", input_path,
-        "-vf", watermark_filter,
-        "-c:v", "libx264", "-preset", "fast", "-crf", "22", "-pix_fmt", "yuv420p",
-        output_path
-    ]
+        st.info("🎞️ Previews need server.enableStaticServing. Use the download button below.")
+
+
+def output_download_button(label, name, file_name, mime="video/mp4"):
+    path = get_output_path(session_id, name)
+    # Deferred: the file is only read when the button is clicked
+    st.download_button(label, lambda: open(path, "rb"), file_name=file_name, mime=mime)
+
+
+FRAME_REUSE_LABEL = "♻️ Reuse styling on still frames (faster for slideshows and held frames)"
+
+# Only the pastel style has quality tiers; every other style renders "exact"
+PASTEL_QUALITY_LABELS = {"🎯 Exact": "exact", "⚡ Fast (preview grade, ~8x faster filter)": "fast"}
+
+
+def pastel_quality_select(style_name, key):
+    if style_name != "🌸 Soft Pastel Anime-Like Style":
+        return "exact"
+    label = st.radio("🌸 Pastel quality", list(PASTEL_QUALITY_LABELS), horizontal=True, key=key)
+    return PASTEL_QUALITY_LABELS[label]
+
+
+# Expandable breakdown of a job's instrumentation.JobMetrics summary
+def show_metrics(summary):
+    with st.expander("📊 Stage timings"):
+        st.caption(
+            f"{summary['seconds']:.2f} sec total · {summary['bytes_read'] / 1024 ** 2:.1f} MB read · "
+            f"{summary['bytes_written'] / 1024 ** 2:.1f} MB written"
+        )
+        st.table([
+            {"Stage": name, "Seconds": stage["seconds"], "Frames": stage["frames"] or None, "FPS": stage["fps"]}
+            for name, stage in summary["stages"].items()
+        ])
+        if summary["latency"]:
+            st.table([
+                {"Per frame": name, "Calls": latency["count"], "p50 ms": latency["p50_ms"],
+                 "p90 ms": latency["p90_ms"], "p99 ms": latency["p99_ms"], "max ms": latency["max_ms"]}
+                for name, latency in summary["latency"].items()
+            ])
+
+
+# ---------- Background Jobs ----------
+# Renders are queued on the shared job scheduler instead of blocking the
+# script. Uploads are written to a job directory here and probed before the
+# job is queued, so an unreadable file is reported at once instead of failing
+# inside the render; the job renders into the directory, stores the outputs in
+# the result cache and removes the directory.
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", 8 * 1024 * 1024))
+
+
+# Writes slices of the upload's own buffer instead of a read() copy of it
+def save_upload(file, path, chunk_size=UPLOAD_CHUNK_BYTES):
+    with file.getbuffer() as view, open(path, "wb") as f:
+        for start in range(0, len(view), chunk_size):
+            f.write(view[start:start + chunk_size])
+
+
+# Returns (job_dir, paths, infos), or (None, None, None) after showing why the
+# uploads cannot be rendered. The probed infos are handed on to the render, so
+# the inputs are not probed again.
+def stage_uploads(files, prefix):
+    job_dir = tempfile.mkdtemp(prefix="job-")
+    paths = []
+    for i, file in enumerate(files):
+        path = os.path.join(job_dir, f"{prefix}{i}.mp4")
+        save_upload(file, path)
+        paths.append(path)
+    try:
+        infos = validate_inputs(paths, [file.name for file in files])
+    except InputError as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        st.error(f"❌ Cannot process the upload: {e}")
+        return None, None, None
+    return job_dir, paths, infos
+
+
+def run_render_job(job, cache_key, job_dir, render, *args, **kwargs):
+    metrics = JobMetrics(job.label, forward=job.report)
+    status = "failed"
     try:
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        st.error("❌ FFmpeg watermarking failed.")
-        st.code(e.stderr.decode(), language="bash")
-        raise
+        metrics.add_bytes(read=get_files_size(os.path.join(job_dir, name) for name in os.listdir(job_dir)))
+        outputs = render(*args, job_dir, progress=metrics, **kwargs)
+        metrics("Saving results")
+        output_bytes = get_files_size(outputs.values())
+        # Rendered once, then read back and copied into the result cache
+        metrics.add_bytes(read=output_bytes, written=2 * output_bytes)
+        results = store_result(cache_key, outputs)
+        status = "done"
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        job.metrics = metrics.finish()
+        log_metrics(job.metrics, job_id=job.id, status=status)
+    return results
+
+
+def submit_render(state_key, cache_key, job_dir, render, *args, priority=PRIORITY_RENDER, label="", **kwargs):
+    job = get_scheduler().submit(
+        run_render_job, cache_key, job_dir, render, *args, priority=priority, label=label, **kwargs
+    )
+    st.session_state[state_key] = job.id
 
-# 🎯 Inject rain options INSIDE Feature 2 & 3 UI blocks (moved in the code below)
-# 🌧️ Add Rain to Feature 2 and 3
-# Use rain_option_2, rain_fn_2 and rain_option_3, rain_fn_3 where needed in processing pipeline.
 
+@st.fragment(run_every=1)
+def show_job_progress(job_id):
+    scheduler = get_scheduler()
+    job = scheduler.get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    if job.status == QUEUED:
+        st.progress(0.0, text=f"⏳ Queued ({scheduler.queue_position(job)} jobs ahead)")
+    else:
+        st.progress(job.fraction, text=f"⚙️ {job.describe()}")
+
+
+# Polls the job tracked under `state_key` and hands a finished job to `on_done`
+def track_job(state_key, on_done):
+    job_id = st.session_state.get(state_key)
+    job = get_scheduler().get(job_id) if job_id else None
+    if job is None:
+        st.session_state[state_key] = None
+    elif job.status == DONE:
+        st.session_state[state_key] = None
+        on_done(job)
+    elif job.status == FAILED:
+        st.session_state[state_key] = None
+        if isinstance(job.error, subprocess.CalledProcessError):
+            st.error("❌ FFmpeg encoding failed.")
+            st.code((job.error.stderr or b"").decode(errors="replace"), language="bash")
+        else:
+            st.error(f"❌ {job.label} failed: {job.error}")
+    else:
+        show_job_progress(job_id)
 
 
 # ========== FEATURE 1 ==========
@@ -117,6 +184,7 @@ style = st.selectbox(
     ["None", "🌸 Soft Pastel Anime-Like Style", "🎞️ Cinematic Warm Filter"],
     key="style_select"
 )
+quality = pastel_quality_select(style, "quality_select")
 
 add_watermark = st.checkbox("✅ Add Watermark (@USMIKASHMIRI)", value=False, key="add_watermark")
 
@@ -126,89 +194,63 @@ rain_option = st.selectbox(
     key="rain_option"
 )
 
+segment_render = st.checkbox(
+    "⚡ Fast render (split into segments across CPU cores)", value=False, key="segment_render"
+)
+frame_reuse = st.checkbox(FRAME_REUSE_LABEL, value=False, key="frame_reuse")
+
 generate = st.button("🌸 Generate Styled Video")
-output_dir = "processed_videos"
-os.makedirs(output_dir, exist_ok=True)
+STYLE_OUTPUT_FILES = ["original.mp4", "styled.mp4", "original_preview.mp4", "styled_preview.mp4"]
+LAYOUT_OUTPUT_FILES = ["raw.mp4", "final.mp4"]
+
+
+def finish_style(results, process_time, metrics=None):
+    for name in STYLE_OUTPUT_FILES:
+        save_output(session_id, f"style_{name}", results[name])
+    st.session_state["styled_output"] = True
+    st.session_state["process_time"] = process_time
+    st.session_state["process_metrics"] = metrics
+
 
 if uploaded_file and generate:
     start_time = time.time()
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_path = os.path.join(tmpdir, "input.mp4")
-        with open(input_path, "wb") as f:
-            f.write(uploaded_file.read())
-
-        clip = VideoFileClip(input_path)
-        transform_fn = get_transform_function(style)
-
-        # Rain logic
-        if rain_option == "🌧️ Light Rain (Default)":
-            def combined_effect(frame):
-                return add_rain_effect(transform_fn(frame), density=0.002)
-            styled_clip = clip.fl_image(combined_effect)
-
-        elif rain_option == "🌦️ Extra Light Rain":
-            def combined_effect(frame):
-                return add_rain_effect(transform_fn(frame), density=0.0008)
-            styled_clip = clip.fl_image(combined_effect)
-
-        elif rain_option == "🌤️ Ultra Light Rain":
-            def combined_effect(frame):
-                return add_rain_effect(transform_fn(frame), density=0.0004)
-            styled_clip = clip.fl_image(combined_effect)
+    watermark_text = WATERMARK_TEXT if add_watermark else None
+    cache_key = make_cache_key(
+        "style", [hash_upload(uploaded_file)], style=style, rain=rain_option, watermark=watermark_text,
+        quality=quality, frame_reuse=frame_reuse,
+    )
+    results = get_cached(cache_key, STYLE_OUTPUT_FILES)
 
-        else:
-            styled_clip = clip.fl_image(transform_fn)
+    if results is not None:
+        finish_style(results, time.time() - start_time)
+    else:
+        job_dir, paths, infos = stage_uploads([uploaded_file], "input")
+        if job_dir:
+            submit_render(
+                "style_job", cache_key, job_dir, render_style_outputs, paths[0],
+                style_name=style, rain_option=rain_option, watermark_text=watermark_text,
+                segment_render=segment_render, quality=quality, frame_reuse=frame_reuse, info=infos[0],
+                label="Styled video",
+            )
 
-        styled_temp = os.path.join(tmpdir, "styled.mp4")
-        styled_clip.write_videofile(styled_temp, codec="libx264", audio_codec="aac")
+track_job("style_job", lambda job: finish_style(job.result, job.finished_at - job.submitted_at, job.metrics))
 
-        if add_watermark:
-            watermarked_output = os.path.join(tmpdir, "styled_watermarked.mp4")
-            apply_watermark(styled_temp, watermarked_output)
-            styled_final_path = watermarked_output
-        else:
-            styled_final_path = styled_temp
-
-        # Generate previews (scaled to height 360)
-        preview_original_temp = os.path.join(tmpdir, "original_preview.mp4")
-        preview_styled_temp = os.path.join(tmpdir, "styled_preview.mp4")
-        clip.resize(height=360).write_videofile(preview_original_temp, codec="libx264", audio_codec="aac")
-        VideoFileClip(styled_final_path).resize(height=360).write_videofile(preview_styled_temp, codec="libx264", audio_codec="aac")
-
-        # Save files to persistent directory
-        orig_final = os.path.join(output_dir, "original.mp4")
-        styled_final = os.path.join(output_dir, "styled.mp4")
-        preview_orig_final = os.path.join(output_dir, "original_preview.mp4")
-        preview_styled_final = os.path.join(output_dir, "styled_preview.mp4")
-
-        shutil.copy(input_path, orig_final)
-        shutil.copy(styled_final_path, styled_final)
-        shutil.copy(preview_original_temp, preview_orig_final)
-        shutil.copy(preview_styled_temp, preview_styled_final)
-
-        # Save in session
-        st.session_state["styled_output_path"] = styled_final
-        st.session_state["original_path"] = orig_final
-        st.session_state["preview_original"] = preview_orig_final
-        st.session_state["preview_styled"] = preview_styled_final
-        st.session_state["process_time"] = time.time() - start_time
-
-# Display result
-if "styled_output_path" in st.session_state:
+# Display result (the store may have expired it since it was rendered)
+if st.session_state.get("styled_output") and get_output_path(session_id, "style_styled.mp4"):
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("🔹 Original")
-        st.video(st.session_state["preview_original"])
-        with open(st.session_state["original_path"], "rb") as f:
-            st.download_button("⬇️ Download Original", f.read(), file_name="original.mp4")
+        show_output_video("style_original_preview.mp4")
+        output_download_button("⬇️ Download Original", "style_original.mp4", file_name="original.mp4")
 
     with col2:
         st.subheader("🔸 Styled")
-        st.video(st.session_state["preview_styled"])
-        with open(st.session_state["styled_output_path"], "rb") as f:
-            st.download_button("⬇️ Download Styled", f.read(), file_name="styled.mp4")
+        show_output_video("style_styled_preview.mp4")
+        output_download_button("⬇️ Download Styled", "style_styled.mp4", file_name="styled.mp4")
 
     st.success(f"✅ Done in {st.session_state['process_time']:.2f} sec")
+    if st.session_state.get("process_metrics"):
+        show_metrics(st.session_state["process_metrics"])
 
 
 
@@ -231,87 +273,57 @@ style_sbs = st.selectbox(
     ["None", "🌸 Soft Pastel Anime-Like Style", "🎞️ Cinematic Warm Filter"],
     key="style_sbs"
 )
+quality_sbs = pastel_quality_select(style_sbs, "quality_sbs")
 
 rain_option_2 = st.selectbox(
     "🌧️ Add Rain to Styled Video (Feature 2)",
     ["None", "🌧️ Light Rain (Default)", "🌦️ Extra Light Rain", "🌤️ Ultra Light Rain"],
     key="rain_option_2"
 )
+frame_reuse_sbs = st.checkbox(FRAME_REUSE_LABEL, value=False, key="frame_reuse_sbs")
+
+
+def finish_side_by_side(results, metrics=None):
+    save_output(session_id, "sbs_raw.mp4", results["raw.mp4"])
+    save_output(session_id, "sbs_final.mp4", results["final.mp4"])
+    st.session_state["sbs_raw_output"] = "sbs_raw.mp4"
+    st.session_state["sbs_final_output"] = "sbs_final.mp4"
+    st.success("✅ Raw and Final videos generated successfully!")
+    if metrics:
+        show_metrics(metrics)
 
-rain_fn_2 = get_rain_function(rain_option_2)
 
 if uploaded_files and len(uploaded_files) == 3:
     if st.button("🚀 Generate Side-by-Side Video"):
-        with st.spinner("Processing..."):
-            with tempfile.TemporaryDirectory() as tmpdir:
-                paths = []
-                for i, file in enumerate(uploaded_files):
-                    path = os.path.join(tmpdir, f"video{i}.mp4")
-                    with open(path, "wb") as f:
-                        f.write(file.read())
-                    paths.append(path)
-
-                target_size = (426, 720)
-                transform_func = get_transform_function(style_sbs)
-
-                raw_clips = []
-                styled_clips = []
-                min_duration = None
-
-                for path in paths:
-                    clip_raw = VideoFileClip(path).resize(target_size)
-                    clip_styled = clip_raw.fl_image(lambda f: rain_fn_2(transform_func(f)))
-
-                    duration = clip_raw.duration
-                    if min_duration is None or duration < min_duration:
-                        min_duration = duration
-
-                    raw_clips.append(clip_raw)
-                    styled_clips.append(clip_styled)
-
-                # Trim both sets to same duration
-                raw_clips = [c.subclip(0, min_duration) for c in raw_clips]
-                styled_clips = [c.subclip(0, min_duration) for c in styled_clips]
-
-                raw_combined = CompositeVideoClip([
-                    raw_clips[0].set_position((0, 0)),
-                    raw_clips[1].set_position((426, 0)),
-                    raw_clips[2].set_position((852, 0))
-                ], size=(1280, 720)).set_duration(min_duration)
-
-                raw_output = os.path.join(tmpdir, "sbs_raw.mp4")
-                raw_combined.write_videofile(raw_output, codec="libx264", audio_codec="aac")
-
-                styled_combined = CompositeVideoClip([
-                    styled_clips[0].set_position((0, 0)),
-                    styled_clips[1].set_position((426, 0)),
-                    styled_clips[2].set_position((852, 0))
-                ], size=(1280, 720)).set_duration(min_duration)
-
-                styled_temp = os.path.join(tmpdir, "styled_temp.mp4")
-                styled_combined.write_videofile(styled_temp, codec="libx264", audio_codec="aac")
-
-                final_output = os.path.join(tmpdir, "sbs_final.mp4")
-                apply_watermark(styled_temp, final_output)
-
-                # Save to session
-                with open(raw_output, "rb") as f:
-                    st.session_state["sbs_raw_output"] = f.read()
-                with open(final_output, "rb") as f:
-                    st.session_state["sbs_final_output"] = f.read()
-
-            st.success("✅ Raw and Final videos generated successfully!")
+        cache_key = make_cache_key(
+            "side_by_side", [hash_upload(f) for f in uploaded_files],
+            style=style_sbs, rain=rain_option_2, watermark=WATERMARK_TEXT, quality=quality_sbs,
+            frame_reuse=frame_reuse_sbs,
+        )
+        results = get_cached(cache_key, LAYOUT_OUTPUT_FILES)
+        if results is not None:
+            finish_side_by_side(results)
+        else:
+            job_dir, paths, infos = stage_uploads(uploaded_files, "video")
+            if job_dir:
+                submit_render(
+                    "sbs_job", cache_key, job_dir, render_side_by_side, paths,
+                    style_name=style_sbs, rain_option=rain_option_2, quality=quality_sbs,
+                    frame_reuse=frame_reuse_sbs, infos=infos, label="Side-by-side video",
+                )
+
+track_job("sbs_job", lambda job: finish_side_by_side(job.result, job.metrics))
 
 # ✅ SHOW VIDEO OUTPUTS
-if st.session_state["sbs_raw_output"]:
+if st.session_state["sbs_raw_output"] and get_output_path(session_id, st.session_state["sbs_raw_output"]):
     st.subheader("🎬 Raw Video (No Style, No Watermark)")
-    st.video(st.session_state["sbs_raw_output"])
-    st.download_button("⬇️ Download Raw", st.session_state["sbs_raw_output"], file_name="raw_unstyled.mp4")
+    show_output_video(st.session_state["sbs_raw_output"])
+    output_download_button("⬇️ Download Raw", st.session_state["sbs_raw_output"], file_name="raw_unstyled.mp4")
 
-if st.session_state["sbs_final_output"]:
+if st.session_state["sbs_final_output"] and get_output_path(session_id, st.session_state["sbs_final_output"]):
     st.subheader("🌟 Final Video (Styled + Watermark)")
-    st.video(st.session_state["sbs_final_output"])
-    st.download_button("⬇️ Download Final", st.session_state["sbs_final_output"], file_name="styled_watermarked.mp4")
+    show_output_video(st.session_state["sbs_final_output"])
+    output_download_button("⬇️ Download Final", st.session_state["sbs_final_output"], file_name="styled_watermarked.mp4")
 # ========== FEATURE 3 (Sequential Playback with 1-Second Triple Intro) ==========
 st.markdown("---")
 st.header("🕒 Play 3 Videos Sequentially with 1s Intro & Watermark")
@@ -329,111 +341,57 @@ style_seq = st.selectbox(
     ["None", "🌸 Soft Pastel Anime-Like Style", "🎞️ Cinematic Warm Filter"],
     key="style_seq"
 )
+quality_seq = pastel_quality_select(style_seq, "quality_seq")
 
 rain_option_3 = st.selectbox(
     "🌧️ Add Rain to Styled Video (Feature 3)",
     ["None", "🌧️ Light Rain (Default)", "🌦️ Extra Light Rain", "🌤️ Ultra Light Rain"],
     key="rain_option_3"
 )
-rain_fn_3 = get_rain_function(rain_option_3)
+frame_reuse_seq = st.checkbox(FRAME_REUSE_LABEL, value=False, key="frame_reuse_seq")
+
+
+def finish_sequential(results, metrics=None):
+    save_output(session_id, "seq_raw.mp4", results["raw.mp4"])
+    save_output(session_id, "seq_final.mp4", results["final.mp4"])
+    st.session_state["seq_raw_output"] = "seq_raw.mp4"
+    st.session_state["seq_final_output"] = "seq_final.mp4"
+    st.success("✅ Sequential videos generated with 1-second intro + full playback + watermark!")
+    if metrics:
+        show_metrics(metrics)
+
 
 if uploaded_seq and len(uploaded_seq) == 3:
     if st.button("🚀 Generate Sequential Video"):
-        with st.spinner("Processing..."):
-            with tempfile.TemporaryDirectory() as tmpdir:
-                paths = []
-                for i, file in enumerate(uploaded_seq):
-                    file_path = os.path.join(tmpdir, f"seq{i}.mp4")
-                    with open(file_path, "wb") as out:
-                        out.write(file.read())
-                    paths.append(file_path)
-
-                transform = get_transform_function(style_seq)
-                width, height = int(1280 / 3), 720
-
-                video_raw = [VideoFileClip(p).resize((width, height)) for p in paths]
-                video_styled = [VideoFileClip(p).fl_image(lambda f: rain_fn_3(transform(f))).resize((width, height)) for p in paths]
-
-                raw_clips, styled_clips = [], []
-
-                # ========== SEGMENT 0: Intro - 1 second, all 3 play normally ==========
-                intro_duration = 1
-                raw_intro = CompositeVideoClip([
-                    video_raw[0].subclip(0, intro_duration).set_position((0, 0)),
-                    video_raw[1].subclip(0, intro_duration).set_position((width, 0)),
-                    video_raw[2].subclip(0, intro_duration).set_position((2 * width, 0))
-                ], size=(1280, height)).set_duration(intro_duration)
-
-                styled_intro = CompositeVideoClip([
-                    video_styled[0].subclip(0, intro_duration).set_position((0, 0)),
-                    video_styled[1].subclip(0, intro_duration).set_position((width, 0)),
-                    video_styled[2].subclip(0, intro_duration).set_position((2 * width, 0))
-                ], size=(1280, height)).set_duration(intro_duration)
-
-                raw_clips.append(raw_intro)
-                styled_clips.append(styled_intro)
-
-                # ========== SEGMENTS 1-3: One plays, others frozen & faded ==========
-                for i in range(3):
-                    dur = video_raw[i].duration
-
-                    raw_parts = []
-                    styled_parts = []
-
-                    for j in range(3):
-                        if j == i:
-                            raw_clip = video_raw[j]
-                            styled_clip = video_styled[j]
-                        else:
-                            safe_t_raw = max(0.1, min(0.5, video_raw[j].duration - 0.1))
-                            safe_t_styled = max(0.1, min(0.5, video_styled[j].duration - 0.1))
-
-                            raw_clip = video_raw[j].to_ImageClip(t=safe_t_raw).set_duration(dur).set_opacity(0.4)
-                            styled_clip = video_styled[j].to_ImageClip(t=safe_t_styled).set_duration(dur).set_opacity(0.4)
-
-                        raw_parts.append(raw_clip.set_position((j * width, 0)))
-                        styled_parts.append(styled_clip.set_position((j * width, 0)))
-
-                    raw_composite = CompositeVideoClip(raw_parts, size=(1280, height)).set_duration(dur)
-                    styled_composite = CompositeVideoClip(styled_parts, size=(1280, height)).set_duration(dur)
-
-                    raw_clips.append(raw_composite)
-                    styled_clips.append(styled_composite)
-
-                # ========== FINAL CONCATENATION ==========
-                raw_sequence = concatenate_videoclips(raw_clips, method="compose")
-                styled_sequence = concatenate_videoclips(styled_clips, method="compose")
-
-                # Safety Check
-                if raw_sequence.duration <= 0 or styled_sequence.duration <= 0:
-                    st.error("❌ One of the output videos has zero duration. Check your input files.")
-                    st.stop()
-
-                raw_output_path = os.path.join(tmpdir, "seq_raw.mp4")
-                styled_temp_path = os.path.join(tmpdir, "seq_styled_temp.mp4")
-                final_output_path = os.path.join(tmpdir, "seq_final.mp4")
-
-                raw_sequence.write_videofile(raw_output_path, codec="libx264", audio_codec="aac")
-                styled_sequence.write_videofile(styled_temp_path, codec="libx264", audio_codec="aac")
-                apply_watermark(styled_temp_path, final_output_path)
-
-                with open(raw_output_path, "rb") as f:
-                    st.session_state["seq_raw_output"] = f.read()
-                with open(final_output_path, "rb") as f:
-                    st.session_state["seq_final_output"] = f.read()
-
-        st.success("✅ Sequential videos generated with 1-second intro + full playback + watermark!")
+        cache_key = make_cache_key(
+            "sequential", [hash_upload(f) for f in uploaded_seq],
+            style=style_seq, rain=rain_option_3, watermark=WATERMARK_TEXT, quality=quality_seq,
+            frame_reuse=frame_reuse_seq,
+        )
+        results = get_cached(cache_key, LAYOUT_OUTPUT_FILES)
+        if results is not None:
+            finish_sequential(results)
+        else:
+            job_dir, paths, infos = stage_uploads(uploaded_seq, "seq")
+            if job_dir:
+                submit_render(
+                    "seq_job", cache_key, job_dir, render_sequential, paths,
+                    style_name=style_seq, rain_option=rain_option_3, quality=quality_seq,
+                    frame_reuse=frame_reuse_seq, infos=infos, label="Sequential video",
+                )
+
+track_job("seq_job", lambda job: finish_sequential(job.result, job.metrics))
 
 # ✅ DISPLAY SECTION
-if st.session_state["seq_raw_output"]:
+if st.session_state["seq_raw_output"] and get_output_path(session_id, st.session_state["seq_raw_output"]):
     st.subheader("🎬 Raw Sequential Video (No Style, No Watermark)")
-    st.video(st.session_state["seq_raw_output"])
-    st.download_button("⬇️ Download Raw", st.session_state["seq_raw_output"], file_name="sequential_raw.mp4")
+    show_output_video(st.session_state["seq_raw_output"])
+    output_download_button("⬇️ Download Raw", st.session_state["seq_raw_output"], file_name="sequential_raw.mp4")
 
-if st.session_state["seq_final_output"]:
+if st.session_state["seq_final_output"] and get_output_path(session_id, st.session_state["seq_final_output"]):
     st.subheader("🌟 Final Sequential Video (Styled + Watermark)")
-    st.video(st.session_state["seq_final_output"])
-    st.download_button("⬇️ Download Final", st.session_state["seq_final_output"], file_name="sequential_styled.mp4")
+    show_output_video(st.session_state["seq_final_output"])
+    output_download_button("⬇️ Download Final", st.session_state["seq_final_output"], file_name="sequential_styled.mp4")
 
 # ========== FEATURE 4 ==========
 st.markdown("---")
@@ -446,46 +404,71 @@ uploaded_thumb_files = st.file_uploader(
     key="thumbnails"
 )
 
+
+def finish_thumbnail(results):
+    # One image per result: combined_thumbnail.jpg or contact_sheet.jpg
+    (name, path), = results.items()
+    save_output(session_id, name, path)
+    st.session_state["thumbnail_output"] = name
+
+
 if uploaded_thumb_files and len(uploaded_thumb_files) == 3:
-    st.subheader("⏱️ Select timestamps (in seconds) for each video")
-    timestamps = [
-        st.number_input(
-            f"Timestamp for video {i+1}",
-            min_value=0.0,
-            value=1.0,
-            step=0.5,
-            key=f"ts_{i}"
-        )
-        for i in range(3)
-    ]
-
-    if st.button("🧩 Generate Combined Thumbnail"):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            images = []
-
-            for idx, file in enumerate(uploaded_thumb_files):
-                path = os.path.join(tmpdir, f"thumb{idx}.mp4")
-                with open(path, "wb") as f:
-                    f.write(file.read())
-
-                clip = VideoFileClip(path)
-                frame = clip.get_frame(timestamps[idx])
-                img = Image.fromarray(frame).resize((426, 720))
-                images.append(img)
-                clip.close()
-
-            combined = Image.new("RGB", (1280, 720))
-            for i, img in enumerate(images):
-                combined.paste(img, (i * 426, 0))
-
-            buffer = BytesIO()
-            combined.save(buffer, format="JPEG")
-            buffer.seek(0)  # ✅ Make sure the buffer is at the start
-
-            st.image(buffer.getvalue(), caption="Combined Thumbnail (1280x720)", use_container_width=True)
-            st.download_button(
-                "💾 Download Thumbnail", 
-                buffer.getvalue(), 
-                file_name="combined_thumbnail.jpg", 
-                mime="image/jpeg"
+    thumbnail_mode = st.radio(
+        "🖼️ Output",
+        ["🧩 Combined thumbnail", "🎞️ Contact sheet"],
+        horizontal=True,
+        key="thumbnail_mode"
+    )
+
+    if thumbnail_mode == "🧩 Combined thumbnail":
+        st.subheader("⏱️ Select timestamps (in seconds) for each video")
+        timestamps = [
+            st.number_input(
+                f"Timestamp for video {i+1}",
+                min_value=0.0,
+                value=1.0,
+                step=0.5,
+                key=f"ts_{i}"
             )
+            for i in range(3)
+        ]
+        output_name = "combined_thumbnail.jpg"
+        feature, settings = "thumbnail", {"timestamps": timestamps}
+        render, render_args = render_thumbnail, [timestamps]
+    else:
+        frame_count = st.slider("🎞️ Frames per video", min_value=2, max_value=8, value=4, key="sheet_frames")
+        output_name = "contact_sheet.jpg"
+        feature, settings = "contact_sheet", {"frames": frame_count}
+        render, render_args = render_contact_sheet, [frame_count]
+
+    if st.button("🧩 Generate Combined Thumbnail" if feature == "thumbnail" else "🎞️ Generate Contact Sheet"):
+        input_hashes = [hash_upload(f) for f in uploaded_thumb_files]
+        cache_key = make_cache_key(feature, input_hashes, **settings)
+        results = get_cached(cache_key, [output_name])
+        if results is not None:
+            finish_thumbnail(results)
+        else:
+            job_dir, paths, infos = stage_uploads(uploaded_thumb_files, "thumb")
+            # The hashes let the frame cache skip videos whose frame did not change
+            if job_dir:
+                submit_render(
+                    "thumbnail_job", cache_key, job_dir, render, paths, *render_args,
+                    input_hashes=input_hashes, infos=infos, priority=PRIORITY_INTERACTIVE, label="Thumbnail",
+                )
+
+    track_job("thumbnail_job", lambda job: finish_thumbnail(job.result))
+
+    thumbnail_name = st.session_state.get("thumbnail_output")
+    thumbnail_path = get_output_path(session_id, thumbnail_name) if thumbnail_name else None
+    if thumbnail_path:
+        if thumbnail_name == "contact_sheet.jpg":
+            caption = "Contact Sheet (one row per video)"
+        else:
+            caption = "Combined Thumbnail (1280x720)"
+        st.image(thumbnail_path, caption=caption, use_container_width=True)
+        output_download_button(
+            "💾 Download Thumbnail",
+            thumbnail_name,
+            file_name=thumbnail_name,
+            mime="image/jpeg"
+        )
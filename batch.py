@@ -0,0 +1,269 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from instrumentation import JobMetrics, get_files_size, log_metrics
+from result_cache import CACHE_VERSION
+from video_processing import (
+    QUALITY_TIERS,
+    WATERMARK_TEXT,
+    render_sequential,
+    render_side_by_side,
+    render_style_outputs,
+    validate_inputs,
+)
+
+# ---------- Batch Rendering ----------
+# Headless entry point for bulk renders: no Streamlit, no uploads. Inputs come
+# from a directory of .mp4 files or a JSON-lines manifest, each job renders in
+# its own process (up to --jobs at once), and finished outputs are written
+# next to a small state file recording the inputs and settings that produced
+# them. A job whose state file still matches is skipped, so rerunning the
+# same command over a growing backlog only renders what is new or changed.
+#
+#   python batch.py clips/ -o out/ --style warm --rain light --jobs 4
+#   python batch.py manifest.jsonl -o out/ --layout side-by-side
+#
+# Manifest lines look like {"inputs": ["a.mp4", "b.mp4", "c.mp4"], "name": "abc",
+# "layout": "side-by-side", "style": "pastel"}; any key left out falls back to
+# the command-line value, and relative paths are resolved against the
+# manifest's directory.
+STYLES = {
+    "none": "None",
+    "pastel": "🌸 Soft Pastel Anime-Like Style",
+    "warm": "🎞️ Cinematic Warm Filter",
+}
+RAIN_OPTIONS = {
+    "none": "None",
+    "light": "🌧️ Light Rain (Default)",
+    "extra-light": "🌦️ Extra Light Rain",
+    "ultra-light": "🌤️ Ultra Light Rain",
+}
+# Number of input videos each layout takes
+LAYOUTS = {"single": 1, "side-by-side": 3, "sequential": 3}
+STATE_DIR_NAME = ".batch-state"
+
+
+# Output file name for each file a pipeline returns
+def get_output_names(name, layout):
+    if layout == "single":
+        return {"styled.mp4": f"{name}.mp4"}
+    return {"raw.mp4": f"{name}_raw.mp4", "final.mp4": f"{name}.mp4"}
+
+
+def make_job(name, inputs, layout, style, rain, watermark, quality="exact", frame_reuse=False):
+    if layout not in LAYOUTS:
+        raise ValueError(f"{name}: unknown layout {layout!r}")
+    if style not in STYLES:
+        raise ValueError(f"{name}: unknown style {style!r}")
+    if rain not in RAIN_OPTIONS:
+        raise ValueError(f"{name}: unknown rain option {rain!r}")
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"{name}: unknown quality {quality!r}")
+    if len(inputs) != LAYOUTS[layout]:
+        raise ValueError(f"{name}: layout {layout!r} takes {LAYOUTS[layout]} inputs, got {len(inputs)}")
+    return {
+        "name": name,
+        "inputs": [os.path.abspath(p) for p in inputs],
+        "layout": layout,
+        "style": style,
+        "rain": rain,
+        "watermark": watermark,
+        "quality": quality,
+        "frame_reuse": bool(frame_reuse),
+    }
+
+
+def jobs_from_directory(directory, layout, style, rain, watermark, quality, frame_reuse):
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(".mp4")
+    )
+    size = LAYOUTS[layout]
+    if len(paths) % size:
+        print(f"⚠️ {len(paths) % size} trailing file(s) do not fill a {layout} group and are skipped",
+              file=sys.stderr)
+    jobs = []
+    for i in range(0, len(paths) - len(paths) % size, size):
+        group = paths[i:i + size]
+        name = "_".join(os.path.splitext(os.path.basename(p))[0] for p in group)
+        jobs.append(make_job(name, group, layout, style, rain, watermark, quality, frame_reuse))
+    return jobs
+
+
+def jobs_from_manifest(manifest_path, layout, style, rain, watermark, quality, frame_reuse):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    with open(manifest_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            inputs = entry.get("inputs") or [entry["input"]]
+            inputs = [os.path.join(base_dir, p) for p in inputs]
+            name = entry.get("name") or "_".join(os.path.splitext(os.path.basename(p))[0] for p in inputs)
+            jobs.append(make_job(
+                name,
+                inputs,
+                entry.get("layout", layout),
+                entry.get("style", style),
+                entry.get("rain", rain),
+                entry.get("watermark", watermark),
+                entry.get("quality", quality),
+                entry.get("frame_reuse", frame_reuse),
+            ))
+    names = [job["name"] for job in jobs]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate output names in manifest: {', '.join(duplicates)}")
+    return jobs
+
+
+# ---------- Up-To-Date Check ----------
+# A job is current when its outputs exist and the state file written after
+# its last successful render describes the same settings and the same input
+# files (path, size and modification time).
+def get_state_path(output_dir, name):
+    return os.path.join(output_dir, STATE_DIR_NAME, f"{name}.json")
+
+
+def get_job_state(job):
+    inputs = []
+    for path in job["inputs"]:
+        stat = os.stat(path)
+        inputs.append([path, stat.st_size, stat.st_mtime_ns])
+    settings = {key: value for key, value in job.items() if key not in ("name", "inputs")}
+    return {"version": CACHE_VERSION, "inputs": inputs, "settings": settings}
+
+
+def is_up_to_date(job, output_dir):
+    outputs = get_output_names(job["name"], job["layout"]).values()
+    if not all(os.path.isfile(os.path.join(output_dir, name)) for name in outputs):
+        return False
+    try:
+        with open(get_state_path(output_dir, job["name"]), encoding="utf-8") as f:
+            return json.load(f) == get_job_state(job)
+    except (OSError, ValueError):
+        return False
+
+
+# Worker: renders one job into a scratch directory inside `output_dir`, then
+# moves the outputs into place and records the state file last. Returns the
+# job's metrics summary, which is also logged like the app's jobs.
+def render_job(job, output_dir):
+    # Rejects unreadable inputs before a scratch directory or decoder is opened;
+    # the renders reuse the probed infos
+    infos = validate_inputs(job["inputs"])
+    metrics = JobMetrics(f"batch/{job['layout']}")
+    metrics.add_bytes(read=get_files_size(job["inputs"]))
+    state = get_job_state(job)
+    style_name = STYLES[job["style"]]
+    rain_option = RAIN_OPTIONS[job["rain"]]
+
+    work_dir = tempfile.mkdtemp(prefix=".batch-", dir=output_dir)
+    try:
+        if job["layout"] == "single":
+            results = render_style_outputs(
+                job["inputs"][0], work_dir, style_name, rain_option, job["watermark"],
+                previews=False, quality=job["quality"], frame_reuse=job["frame_reuse"], progress=metrics,
+                info=infos[0],
+            )
+        elif job["layout"] == "side-by-side":
+            results = render_side_by_side(
+                job["inputs"], work_dir, style_name, rain_option, job["watermark"],
+                quality=job["quality"], frame_reuse=job["frame_reuse"], progress=metrics, infos=infos,
+            )
+        else:
+            results = render_sequential(
+                job["inputs"], work_dir, style_name, rain_option, job["watermark"],
+                quality=job["quality"], frame_reuse=job["frame_reuse"], progress=metrics, infos=infos,
+            )
+
+        output_names = get_output_names(job["name"], job["layout"])
+        metrics.add_bytes(written=get_files_size(results[name] for name in output_names))
+
+        for result_name, output_name in output_names.items():
+            os.replace(results[result_name], os.path.join(output_dir, output_name))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    state_path = get_state_path(output_dir, job["name"])
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(state_path + ".tmp", state_path)
+
+    summary = metrics.finish()
+    log_metrics(summary, job=job["name"], status="done")
+    return summary
+
+
+def run_batch(jobs, output_dir, workers, force=False):
+    os.makedirs(output_dir, exist_ok=True)
+    pending = [job for job in jobs if force or not is_up_to_date(job, output_dir)]
+    print(f"{len(jobs)} job(s), {len(jobs) - len(pending)} up to date, {len(pending)} to render")
+    if not pending:
+        return 0
+
+    # Each job already filters frames on a thread pool; split the cores
+    # between the job processes unless FRAME_WORKERS was set explicitly
+    os.environ.setdefault("FRAME_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+    failed = 0
+    # spawn, like the segment renderer: workers start from a clean interpreter
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(render_job, job, output_dir): job for job in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                summary = future.result()
+                print(f"[{done}/{len(pending)}] ✅ {job['name']} ({summary['seconds']:.1f} sec)")
+            except Exception as e:
+                failed += 1
+                stderr = getattr(e, "stderr", None)
+                detail = stderr.decode(errors="replace").strip().splitlines()[-1:] if stderr else []
+                print(f"[{done}/{len(pending)}] ❌ {job['name']}: {e}", *detail, sep="\n    ", file=sys.stderr)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render videos in bulk without the Streamlit UI.")
+    parser.add_argument("source", help="directory of .mp4 files or a JSON-lines manifest")
+    parser.add_argument("-o", "--output-dir", required=True, help="where rendered videos are written")
+    parser.add_argument("--layout", choices=LAYOUTS, default="single")
+    parser.add_argument("--style", choices=STYLES, default="none")
+    parser.add_argument("--rain", choices=RAIN_OPTIONS, default="none")
+    parser.add_argument("--quality", choices=QUALITY_TIERS, default="exact",
+                        help="pastel filter quality; fast is preview grade")
+    parser.add_argument("--frame-reuse", action="store_true",
+                        help="reuse styled results on still or held frames")
+    parser.add_argument("--watermark", nargs="?", const=WATERMARK_TEXT, default=None,
+                        help=f"scrolling watermark text (default when given without a value: {WATERMARK_TEXT})")
+    parser.add_argument("-j", "--jobs", type=int, default=max(1, (os.cpu_count() or 1) // 4),
+                        help="number of videos rendered in parallel")
+    parser.add_argument("--force", action="store_true", help="render even when outputs are up to date")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.source):
+        load_jobs = jobs_from_directory
+    else:
+        load_jobs = jobs_from_manifest
+    try:
+        jobs = load_jobs(args.source, args.layout, args.style, args.rain, args.watermark, args.quality, args.frame_reuse)
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(str(e))
+
+    failed = run_batch(jobs, args.output_dir, max(1, args.jobs), force=args.force)
+    if failed:
+        print(f"{failed} job(s) failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
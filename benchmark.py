@@ -0,0 +1,304 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import cv2
+from moviepy.editor import VideoFileClip
+
+from batch import RAIN_OPTIONS, STYLES
+from instrumentation import JobMetrics
+from video_processing import (
+    FRAME_WORKERS,
+    QUALITY_TIERS,
+    apply_watermark,
+    get_rain_function,
+    get_transform_function,
+    render_sequential,
+    render_side_by_side,
+    write_clip,
+)
+
+# ---------- Benchmark Suite ----------
+# Measures rendering throughput on synthetic clips so changes can be compared
+# across commits:
+#
+#   python benchmark.py -o results.json
+#   python benchmark.py --resolutions 1280x720 --durations 5 --only style/
+#
+# Clips are generated locally with ffmpeg's testsrc2 and a sine tone, so
+# every machine benchmarks the same content, and every case runs in a fresh
+# interpreter seeded with SEED. That keeps grain and rain drops identical
+# between runs and makes each case's peak RSS (including ffmpeg children) its
+# own. Results are written as JSON; fps is frames / median wall time, and the
+# stage and per-frame latency breakdown comes from instrumentation.JobMetrics.
+SEED = 1234
+DEFAULT_RESOLUTIONS = ["640x360", "1280x720", "1920x1080"]
+DEFAULT_DURATIONS = [2.0, 5.0]
+CLIP_FPS = 30
+# Filter cases cycle through this many decoded frames instead of holding
+# the whole clip in memory
+FILTER_SAMPLE_FRAMES = 48
+
+
+def generate_clip(path, size, duration, fps=CLIP_FPS):
+    width, height = size
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-g", str(fps),
+        "-c:a", "aac", "-shortest", path,
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return path
+
+
+def list_cases():
+    cases = ["decode", "encode", "watermark"]
+    cases += [f"style/{name}" for name in STYLES if name != "none"]
+    cases += [f"style/pastel:{quality}" for quality in QUALITY_TIERS if quality != "exact"]
+    cases += [f"quality/pastel:{quality}" for quality in QUALITY_TIERS if quality != "exact"]
+    cases += [f"rain/{name}" for name in RAIN_OPTIONS if name != "none"]
+    cases += [f"{layout}/{style}" for layout in ("side-by-side", "sequential") for style in STYLES]
+    return cases
+
+
+def load_sample_frames(clip_path):
+    with VideoFileClip(clip_path, audio=False) as clip:
+        fps = clip.fps
+        total = int(round(clip.duration * fps))
+        frames = []
+        for frame in clip.iter_frames(dtype="uint8"):
+            frames.append(frame)
+            if len(frames) == FILTER_SAMPLE_FRAMES:
+                break
+    return frames, fps, total
+
+
+def time_frame_fn(clip_path, frame_fn):
+    frames, fps, total = load_sample_frames(clip_path)
+    start = time.perf_counter()
+    for i in range(total):
+        frame_fn(frames[i % len(frames)], i / fps)
+    return total, time.perf_counter() - start
+
+
+def get_psnr(reference, frame):
+    mse = np.mean((reference.astype(np.float64) - frame) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+# Quality-vs-speed of a style's quality tier against its exact output on the
+# sample frames: PSNR (higher is closer) and the filter speedup
+def compare_quality(clip_path, style_name, quality):
+    frames, _, _ = load_sample_frames(clip_path)
+    timings, outputs = {}, {}
+    for tier in ("exact", quality):
+        transform_fn = get_transform_function(style_name, tier)
+        start = time.perf_counter()
+        outputs[tier] = [transform_fn(frame) for frame in frames]
+        timings[tier] = time.perf_counter() - start
+
+    psnr = [get_psnr(a, b) for a, b in zip(outputs["exact"], outputs[quality])]
+    report = {
+        "exact_ms_per_frame": round(timings["exact"] / len(frames) * 1000, 3),
+        f"{quality}_ms_per_frame": round(timings[quality] / len(frames) * 1000, 3),
+        "speedup": round(timings["exact"] / timings[quality], 2),
+        "psnr_mean_db": round(float(np.mean(psnr)), 2),
+        "psnr_min_db": round(float(np.min(psnr)), 2),
+    }
+    return len(frames), timings[quality], report
+
+
+# Runs one case and returns frames processed, wall seconds and the metrics
+# summary (stage timings and per-frame latencies)
+def run_case(case, clip_path, work_dir):
+    kind, _, option = case.partition("/")
+    option, _, quality = option.partition(":")
+    metrics = JobMetrics(case)
+
+    if kind == "style":
+        transform_fn = get_transform_function(STYLES[option], quality or "exact")
+        frames, seconds = time_frame_fn(clip_path, lambda f, t: transform_fn(f))
+        return frames, seconds, None
+    if kind == "quality":
+        frames, seconds, report = compare_quality(clip_path, STYLES[option], quality)
+        return frames, seconds, {"stages": {}, "latency": {}, "quality": report}
+    if kind == "rain":
+        rain_fn = get_rain_function(RAIN_OPTIONS[option])
+        frames, seconds = time_frame_fn(clip_path, rain_fn)
+        return frames, seconds, None
+
+    start = time.perf_counter()
+    if kind == "decode":
+        with VideoFileClip(clip_path, audio=False) as clip:
+            frames = sum(1 for _ in clip.iter_frames(dtype="uint8"))
+    elif kind == "encode":
+        with VideoFileClip(clip_path) as clip:
+            frames = int(round(clip.duration * clip.fps))
+            write_clip(clip, os.path.join(work_dir, "encode.mp4"), audio_path=clip_path, progress=metrics)
+    elif kind == "watermark":
+        with VideoFileClip(clip_path, audio=False) as clip:
+            frames = int(round(clip.duration * clip.fps))
+        apply_watermark(clip_path, os.path.join(work_dir, "watermark.mp4"))
+    elif kind in ("side-by-side", "sequential"):
+        render = render_side_by_side if kind == "side-by-side" else render_sequential
+        outputs = render([clip_path] * 3, work_dir, STYLES[option], "None", progress=metrics)
+        with VideoFileClip(outputs["final.mp4"], audio=False) as clip:
+            frames = int(round(clip.duration * clip.fps))
+    else:
+        raise ValueError(f"unknown benchmark case {case!r}")
+    seconds = time.perf_counter() - start
+    return frames, seconds, metrics.finish()
+
+
+def get_peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(max(own, children) / scale, 1)
+
+
+# Child-process entry point: seeds every RNG, runs the case, writes JSON
+def run_case_process(case, clip_path, result_path):
+    random.seed(SEED)
+    np.random.seed(SEED)
+    cv2.setRNGSeed(SEED)
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            frames, seconds, summary = run_case(case, clip_path, work_dir)
+            result = {
+                "frames": frames,
+                "seconds": seconds,
+                "stages": summary["stages"] if summary else {},
+                "latency": summary["latency"] if summary else {},
+                "quality": summary.get("quality") if summary else None,
+                "error": None,
+            }
+        except subprocess.CalledProcessError as e:
+            stderr = (e.stderr or b"").decode(errors="replace").strip().splitlines()
+            result = {"error": stderr[-1] if stderr else str(e)}
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+    result["peak_rss_mb"] = get_peak_rss_mb()
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+def measure(case, clip_path, repeat, work_dir):
+    runs = []
+    result_path = os.path.join(work_dir, "case.json")
+    for _ in range(repeat):
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-case", case, clip_path, result_path]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(result_path) as f:
+            run = json.load(f)
+        if run["error"]:
+            return {"error": run["error"], "peak_rss_mb": run["peak_rss_mb"]}
+        runs.append(run)
+
+    seconds = statistics.median(run["seconds"] for run in runs)
+    median_run = min(runs, key=lambda run: abs(run["seconds"] - seconds))
+    frames = runs[0]["frames"]
+    return {
+        "frames": frames,
+        "seconds": round(seconds, 4),
+        "fps": round(frames / seconds, 2) if seconds > 0 else None,
+        "runs": [round(run["seconds"], 4) for run in runs],
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        **{key: median_run[key] for key in ("stages", "latency", "quality")},
+        "error": None,
+    }
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "frame_workers": FRAME_WORKERS,
+        "seed": SEED,
+    }
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendering stages on synthetic clips.")
+    parser.add_argument("-o", "--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--resolutions", default=",".join(DEFAULT_RESOLUTIONS),
+                        help="comma-separated WIDTHxHEIGHT list")
+    parser.add_argument("--durations", default=",".join(str(d) for d in DEFAULT_DURATIONS),
+                        help="comma-separated clip durations in seconds")
+    parser.add_argument("--only", action="append", default=[],
+                        help="only run cases containing this text (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the median is reported")
+    parser.add_argument("--clip-dir", help="keep generated clips here between benchmark runs")
+    parser.add_argument("--run-case", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        run_case_process(*args.run_case)
+        return 0
+
+    sizes = [parse_size(s) for s in args.resolutions.split(",")]
+    durations = [float(d) for d in args.durations.split(",")]
+    cases = [c for c in list_cases() if not args.only or any(text in c for text in args.only)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        clip_dir = args.clip_dir or work_dir
+        os.makedirs(clip_dir, exist_ok=True)
+        for width, height in sizes:
+            for duration in durations:
+                clip_path = os.path.join(clip_dir, f"synthetic_{width}x{height}_{duration:g}s.mp4")
+                if not os.path.isfile(clip_path):
+                    generate_clip(clip_path, (width, height), duration)
+                for case in cases:
+                    result = {"case": case, "resolution": f"{width}x{height}", "duration": duration}
+                    result.update(measure(case, clip_path, max(1, args.repeat), work_dir))
+                    results.append(result)
+                    if result["error"]:
+                        line = f"❌ {result['error']}"
+                    elif result["quality"]:
+                        line = (f"{result['quality']['speedup']:9.1f}x    "
+                                f"PSNR {result['quality']['psnr_mean_db']:.2f} dB vs exact")
+                    else:
+                        line = f"{result['fps']:9.1f} fps  {result['peak_rss_mb']:8.1f} MB"
+                    print(f"{case:28} {width}x{height} {duration:5g}s  {line}", file=sys.stderr)
+
+    report = json.dumps({"environment": get_environment(), "results": results}, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+# ---------- Job Metrics ----------
+# A JobMetrics object is a progress callback that also keeps the numbers
+# behind a render: wall time and frame counts per stage (a stage lasts from
+# its first report until the next stage starts), latency samples for the
+# per-frame hot paths (filter, frame read, encoder write) and bytes read and
+# written. Rendering functions record latencies through its `record` method
+# when the progress callback they were handed has one. Each finished job is
+# written as one JSON line to METRICS_LOG_PATH and to the "metrics" logger.
+METRICS_LOG_PATH = os.environ.get("METRICS_LOG_PATH", os.path.join("processed_videos", "metrics.jsonl"))
+LATENCY_PERCENTILES = (50, 90, 99)
+
+logger = logging.getLogger("metrics")
+_log_lock = threading.Lock()
+
+
+class JobMetrics:
+    def __init__(self, feature, forward=None):
+        self.feature = feature
+        self.forward = forward
+        self.started = time.perf_counter()
+        self.finished = None
+        # Time before the first report (opening inputs, probing) is "Setup"
+        self.stages = {"Setup": {"start": self.started, "frames": 0}}
+        self.latencies = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, frames_done=None, frames_total=None):
+        now = time.perf_counter()
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"start": now, "frames": 0})
+            if frames_done:
+                entry["frames"] = max(entry["frames"], frames_done)
+        if self.forward:
+            self.forward(stage, frames_done, frames_total)
+
+    # Called from frame worker threads with one latency sample in seconds
+    def record(self, name, seconds):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def add_bytes(self, read=0, written=0):
+        with self._lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        return self.summary()
+
+    def summary(self):
+        end = self.finished or time.perf_counter()
+        with self._lock:
+            names = list(self.stages)
+            stages = {}
+            for name, next_name in zip(names, names[1:] + [None]):
+                entry = self.stages[name]
+                stage_end = self.stages[next_name]["start"] if next_name else end
+                seconds = stage_end - entry["start"]
+                stages[name] = {
+                    "seconds": round(seconds, 4),
+                    "frames": entry["frames"],
+                    "fps": round(entry["frames"] / seconds, 2) if entry["frames"] and seconds > 0 else None,
+                }
+            latency = {}
+            for name, samples in self.latencies.items():
+                values = np.array(samples) * 1000
+                latency[name] = {
+                    "count": len(samples),
+                    "mean_ms": round(float(values.mean()), 3),
+                    **{f"p{p}_ms": round(float(np.percentile(values, p)), 3) for p in LATENCY_PERCENTILES},
+                    "max_ms": round(float(values.max()), 3),
+                }
+            return {
+                "feature": self.feature,
+                "seconds": round(end - self.started, 4),
+                "stages": stages,
+                "latency": latency,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+
+
+def get_files_size(paths):
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+
+# Appends one JSON line per job; `extra` adds fields such as the job id
+def log_metrics(summary, log_path=METRICS_LOG_PATH, **extra):
+    line = json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **extra, **summary}, ensure_ascii=False)
+    logger.info(line)
+    if not log_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        with _log_lock, open(log_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logger.warning("could not write metrics log %s: %s", log_path, e)
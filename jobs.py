@@ -0,0 +1,153 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+# ---------- Job Scheduler ----------
+# Renders run as jobs on a fixed pool of JOB_WORKERS background threads
+# instead of inside the Streamlit script thread. That pool is the global
+# concurrency cap: extra requests wait in a priority queue (lower number runs
+# first, FIFO within a priority). Interactive jobs (thumbnails, well under a
+# second each) get their own lane of INTERACTIVE_WORKERS threads so they never
+# wait behind a multi-minute render. Jobs report their stage and frame
+# progress, the UI polls it, and finished jobs are kept for
+# JOB_RETENTION_SECONDS so a session can pick up the result on its next rerun.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", max(1, (os.cpu_count() or 1) // 4)))
+INTERACTIVE_WORKERS = int(os.environ.get("INTERACTIVE_WORKERS", 1))
+JOB_RETENTION_SECONDS = 60 * 60
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_RENDER = 10
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class Job:
+    def __init__(self, fn, args, kwargs, priority=PRIORITY_RENDER, label=""):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.label = label
+        self.status = QUEUED
+        self.stage = "Queued"
+        self.frames_done = None
+        self.frames_total = None
+        self.result = None
+        self.error = None
+        self.metrics = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    # Progress callback handed to the rendering functions
+    def report(self, stage=None, frames_done=None, frames_total=None):
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            self.frames_done = frames_done
+            self.frames_total = frames_total
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    @property
+    def fraction(self):
+        with self._lock:
+            if self.status == DONE:
+                return 1.0
+            if not self.frames_total or self.frames_done is None:
+                return 0.0
+            return min(1.0, self.frames_done / self.frames_total)
+
+    def describe(self):
+        with self._lock:
+            if self.frames_total and self.frames_done is not None:
+                return f"{self.stage}: {self.frames_done}/{self.frames_total} frames"
+            return self.stage
+
+
+# Lane a job runs in: True for the interactive lane
+def is_interactive(priority):
+    return priority <= PRIORITY_INTERACTIVE
+
+
+class JobScheduler:
+    def __init__(self, workers=JOB_WORKERS, interactive_workers=INTERACTIVE_WORKERS):
+        self.workers = workers
+        self._queues = {False: queue.PriorityQueue(), True: queue.PriorityQueue()}
+        self._order = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, args=(False,), name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ] + [
+            threading.Thread(target=self._run, args=(True,), name=f"interactive-worker-{i}", daemon=True)
+            for i in range(interactive_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # Queues fn(job, *args, **kwargs); the job is passed in for progress reports
+    def submit(self, fn, *args, priority=PRIORITY_RENDER, label="", **kwargs):
+        job = Job(fn, args, kwargs, priority, label)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._queues[is_interactive(priority)].put((priority, next(self._order), job))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Number of queued jobs in the same lane that will start before `job`
+    def queue_position(self, job):
+        lane = is_interactive(job.priority)
+        with self._lock:
+            return sum(
+                1 for other in self._jobs.values()
+                if other.status == QUEUED and is_interactive(other.priority) == lane
+                and (other.priority, other.submitted_at) < (job.priority, job.submitted_at)
+            )
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, interactive):
+        jobs = self._queues[interactive]
+        while True:
+            _, _, job = jobs.get()
+            job.started_at = time.time()
+            job.status = RUNNING
+            job.report("Starting")
+            status, stage = FAILED, "Failed"
+            try:
+                job.result = job.fn(job, *job.args, **job.kwargs)
+                status, stage = DONE, "Done"
+            except Exception as e:
+                job.error = e
+            finally:
+                job.finished_at = time.time()
+                # Drop references to inputs as soon as the job is over
+                job.fn = job.args = job.kwargs = None
+                # Published last: whoever sees a finished status (the UI,
+                # _prune) also sees finished_at and the result or error
+                with job._lock:
+                    job.status = status
+                job.report(stage)
+                jobs.task_done()
+
+
+@lru_cache(maxsize=None)
+def get_scheduler():
+    return JobScheduler()
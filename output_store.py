@@ -0,0 +1,110 @@
+import os
+import shutil
+import time
+import uuid
+
+# ---------- Output Store ----------
+# Rendered artifacts live on disk in one directory per browser session; the
+# session only keeps the file names. The directories sit under the app's
+# `static/` folder so Streamlit's static file serving can stream them to the
+# video player straight from disk. Sessions idle for longer than
+# OUTPUT_TTL_SECONDS are removed, and the oldest ones go first whenever the
+# store grows past OUTPUT_STORE_MAX_BYTES.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STORE_DIR = os.path.join(STATIC_DIR, "outputs")
+# Leading slash: Streamlit only treats "/app/static/..." strings as URLs
+STATIC_URL_PREFIX = "/app/static/outputs"
+# Largest file Streamlit's static route will serve
+MAX_STATIC_FILE_BYTES = 200 * 1024 * 1024
+OUTPUT_TTL_SECONDS = int(os.environ.get("OUTPUT_TTL_SECONDS", 60 * 60))
+OUTPUT_STORE_MAX_BYTES = int(os.environ.get("OUTPUT_STORE_MAX_BYTES", 2 * 1024 ** 3))
+CLEANUP_INTERVAL_SECONDS = 60
+
+_last_cleanup = [0.0]
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def get_session_dir(session_id):
+    return os.path.join(STORE_DIR, session_id)
+
+
+# Puts `source_path` into the session's store as `name`. Hard-links when
+# possible so artifacts shared with the result cache cost no extra disk space
+# and survive cache eviction.
+def save_output(session_id, name, source_path):
+    session_dir = get_session_dir(session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    target = os.path.join(session_dir, name)
+    staging = target + ".tmp"
+    try:
+        os.link(source_path, staging)
+    except OSError:
+        shutil.copy(source_path, staging)
+    os.replace(staging, target)
+    os.utime(session_dir)
+    return target
+
+
+def get_output_path(session_id, name):
+    path = os.path.join(get_session_dir(session_id), name)
+    if not os.path.isfile(path):
+        return None
+    try:
+        os.utime(get_session_dir(session_id))
+    except FileNotFoundError:
+        return None
+    return path
+
+
+# Static URL for the player, or None when the file is too big to be served
+def get_output_url(session_id, name):
+    path = get_output_path(session_id, name)
+    if path is None or os.path.getsize(path) > MAX_STATIC_FILE_BYTES:
+        return None
+    return f"{STATIC_URL_PREFIX}/{session_id}/{name}"
+
+
+def get_dir_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def cleanup_outputs(ttl=OUTPUT_TTL_SECONDS, max_bytes=OUTPUT_STORE_MAX_BYTES, keep=None, force=False):
+    now = time.time()
+    if not force and now - _last_cleanup[0] < CLEANUP_INTERVAL_SECONDS:
+        return
+    _last_cleanup[0] = now
+    if not os.path.isdir(STORE_DIR):
+        return
+
+    sessions = []
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        if not os.path.isdir(path):
+            continue
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if name != keep and now - mtime > ttl:
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            sessions.append((mtime, name, path, get_dir_size(path)))
+
+    total = sum(size for _, _, _, size in sessions)
+    for _, name, path, size in sorted(sessions):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
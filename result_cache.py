@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# ---------- Result Cache ----------
+# Finished renders are stored on disk under a key derived from the uploaded
+# bytes and every setting that changes the output, so an identical request
+# (same upload, style, rain, watermark, feature) is served without decoding
+# anything. Each entry is a directory that appears atomically once complete;
+# its mtime is bumped on every hit and the least recently used entries are
+# evicted once the cache grows past CACHE_MAX_BYTES.
+CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join("processed_videos", "cache"))
+CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+# Bump when a rendering change makes previously cached outputs stale
+CACHE_VERSION = 1
+
+
+def hash_upload(uploaded_file):
+    with uploaded_file.getbuffer() as view:
+        return hashlib.sha256(view).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(feature, input_hashes, **settings):
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "feature": feature, "inputs": list(input_hashes), "settings": settings},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_entry_dir(key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, key)
+
+
+# Returns {name: path} for a complete entry containing all `names`, else None
+def get_cached(key, names, cache_dir=CACHE_DIR):
+    entry = get_entry_dir(key, cache_dir)
+    paths = {name: os.path.join(entry, name) for name in names}
+    if not all(os.path.isfile(p) for p in paths.values()):
+        return None
+    try:
+        os.utime(entry)
+    except FileNotFoundError:
+        # Evicted between the check and the touch
+        return None
+    return paths
+
+
+# Copies `files` ({name: source path}) into a new entry and returns {name: path}
+def store_result(key, files, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = get_entry_dir(key, cache_dir)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=cache_dir)
+    try:
+        for name, source in files.items():
+            shutil.copy(source, os.path.join(staging, name))
+        if os.path.isdir(entry):
+            # Another session stored the same result first
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(staging, entry)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    evict(max_bytes, cache_dir, keep=key)
+    return {name: os.path.join(entry, name) for name in files}
+
+
+def get_entry_size(entry):
+    total = 0
+    for root, _, names in os.walk(entry):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+# Removes least recently used entries until the cache fits in `max_bytes`
+def evict(max_bytes=CACHE_MAX_BYTES, cache_dir=CACHE_DIR, keep=None):
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), name, path, get_entry_size(path)))
+        except OSError:
+            continue
+
+    total = sum(size for _, _, _, size in entries)
+    for _, name, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size